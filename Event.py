@@ -1,7 +1,8 @@
 '''This class stores the following event data for ease of use:
 t - time data.
-x - x-coordinate data.
-y - y-coordinate data.
+x_idx / y_idx - indices of the hits that were read on x planes (even) / y planes (odd).
+x_vals / y_vals - x- / y-coordinate data for those hits only, with no NaN padding.
+x_z / y_z - z-coordinate data for those hits only.
 z - z-coordinate data; i.e., the number of planes deep into the ATAR
 E - energy deposited at the given read time
 E_per_plane - energy deposited per plane. Should be of length 50 since there are 50 planes.
@@ -12,7 +13,9 @@ thetas - from calorimeter, represents theta values at which energy is deposited.
 phis - from calorimeter, represents phi values at which energy is deposited.
 crystal ids - a list of 6-digit numbers, the means by which we identify in which crystals energy is deposited.
 calo_edep - energy deposited at each Calo ID location.
-r_theta_phis - coordinate pairs (theta, phi) that we will plot later.
+
+Once an event has been processed, the per-hit data are stored as NumPy arrays with compact dtypes: plane numbers and strip values as uint8,
+E as float32, and t as float64.
 '''
 
 import numpy as np
@@ -21,11 +24,15 @@ class Event:
 
     def __init__(self):
         self.t_data = []
-        self.x_data = []
-        self.y_data = []
+        self.x_idx = []
+        self.y_idx = []
+        self.x_vals = []
+        self.y_vals = []
+        self.x_z = []
+        self.y_z = []
         self.z_data = []
         self.E_data = []
-        self.E_per_plane = np.zeros(50)
+        self.E_per_plane = np.zeros(50, dtype = np.float64)
         self.pixel_pdgs = []
         self.max_E = []
         self.gap_times = []
@@ -33,4 +40,3 @@ class Event:
         self.phis = []
         self.crystal_ids = []
         self.calo_edep = []
-        self.r_theta_phis = []
\ No newline at end of file
@@ -0,0 +1,80 @@
+'''
+This module holds a Numba-compiled version of the per-hit loop used to process ATAR events. It is meant for the PyROOT code path (see
+atar_exploration.py), where the pixel branches are read one entry at a time rather than in bulk with uproot. The hit data are passed in as
+NumPy arrays and all of the per-hit quantities are computed in a single compiled pass.
+
+Numba is optional. If it is not installed, compute() falls back to an equivalent set of NumPy array operations, which gives the same results
+without the compiled loop.
+'''
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+'''
+Computes the per-hit plane numbers and strip values for an event, along with the energy deposited per plane and the large time gaps.
+hits: The pixel_hits values, e.g. 100036 for plate 1, strip 36 (see process_event() in atar_exploration.py).
+times: The pixel_time values in ns.
+edep: The pixel_edep values in MeV.
+npp (optional): The number of pixels (strips) per plane.
+n_planes (optional): The number of planes in the ATAR.
+Returns (plane, cur_val, is_x, E_per_plane, gap_times, max_E), where is_x is True for hits on the even (x) planes. plane and cur_val are
+uint8 arrays, since there are fewer than 256 planes and strips per plane. Raises an IndexError if a hit lies outside of the n_planes planes.
+'''
+def _compute_loop(hits, times, edep, npp = 100, n_planes = 50):
+    N = hits.shape[0]
+    plane = np.empty(N, np.uint8)
+    cur = np.empty(N, np.uint8)
+    is_x = np.empty(N, np.bool_)
+    E = np.zeros(n_planes, np.float64)
+    gaps = np.empty(N, np.float64)
+    g = 0
+
+    #The first hit is measured from t = 0, so a late first hit also counts as a gap.
+    last = 0.0
+    for i in range(N):
+        p = (hits[i] - 100_001) // npp
+
+        #The compiled loop does no bounds checking of its own, so a bad hit would otherwise write outside of E and wrap around in plane.
+        if p < 0 or p >= n_planes:
+            raise IndexError("pixel hit lies outside of the ATAR planes")
+
+        plane[i] = p
+        cur[i] = (hits[i] - 1) % npp
+        is_x[i] = (p & 1) == 0
+        E[p] += edep[i]
+
+        #TODO: Adjust this time gap (in ns) as needed.
+        if times[i] - last > 1.0:
+            gaps[g] = times[i] - last
+            g += 1
+        last = times[i]
+
+    return plane, cur, is_x, E, gaps[:g], E.max()
+
+
+#The same computation as _compute_loop(), written as NumPy array operations for when Numba is not available.
+def _compute_numpy(hits, times, edep, npp = 100, n_planes = 50):
+    plane = (hits - 100_001) // npp
+    if len(plane) > 0 and (plane.min() < 0 or plane.max() >= n_planes):
+        raise IndexError("pixel hit lies outside of the ATAR planes")
+
+    cur = (hits - 1) % npp
+    is_x = (plane & 1) == 0
+    #bincount() returns int64 counts when there are no hits, so the sums are cast to float64 to match the loop.
+    E = np.bincount(plane, weights = edep, minlength = n_planes).astype(np.float64, copy = False)
+
+    #The first hit is measured from t = 0, so a late first hit also counts as a gap.
+    gaps = np.diff(times, prepend = 0.0)
+
+    return plane.astype(np.uint8), cur.astype(np.uint8), is_x, E, gaps[gaps > 1.0], E.max()      #TODO: Adjust this time gap (in ns) as needed.
+
+
+if njit is not None:
+    compute = njit(cache = True, fastmath = True)(_compute_loop)
+else:
+    compute = _compute_numpy
@@ -7,6 +7,24 @@ import numpy as np
 from matplotlib import pyplot as plt
 from Event import Event
 import calo_analysis
+import _event_kernel
+
+
+#The crystal geometry is the same for every event, so we only extract the theta and phi values once, as separate arrays that each have one extra
+#NaN at the end for crystal IDs that are not in the geometry. They are loaded the first time an event is processed rather than on import, since
+#calo_analysis reads the geometry file relative to the current working directory.
+crys_ids = None
+crys_thetas = None
+crys_phis = None
+
+
+#Fills the crystal geometry cache above if it has not been filled yet.
+def load_crystal_arrays():
+    global crys_ids, crys_thetas, crys_phis
+    if crys_ids is None:
+        crys_ids, _, thetas, phis = calo_analysis.get_crystal_arrays()
+        crys_thetas = np.append(thetas, np.nan)
+        crys_phis = np.append(phis, np.nan)
 
 
 '''
@@ -21,65 +39,63 @@ def process_event(tree, tree_calo, event_index):
     tree.GetEntry(event_index)
     tree_calo.GetEntry(event_index)
 
-    #Store pixel hits for the entry printed above in which a pion didn't decay at rest.
-    pixel_times = tree.pixel_time
-    pixel_hits = tree.pixel_hits
-    pixel_edep = tree.pixel_edep
+    #Store pixel hits for the entry printed above in which a pion didn't decay at rest. Each branch is loaded from the tree once and converted
+    #straight from the ROOT vector's buffer. times and edep are kept by the event, so they are copied, since ROOT refills the same vectors on
+    #the next GetEntry().
+    hits = np.asarray(tree.pixel_hits, dtype = np.int64)
+    times = np.array(tree.pixel_time, dtype = np.float64)
+    edep = np.array(tree.pixel_edep, dtype = np.float64)
     
-    #Initialize lists for storing color (for labeling data points according to decay product), t, x, y, z, energy, and energy per plane using the Event class.
+    #Initialize arrays for storing t, x, y, z, energy, and energy per plane using the Event class.
     npixels_per_plane = 100
     event = Event()
 
-    #Init time value so 1st loop below works.
-    cur_time = 0
-    
-    #Extract x vs. t, y vs. t, and z vs. t data. Also add indexed color coding to represent different particles.
-    for i in range(pixel_hits.size()):
-        plane = int(np.floor((pixel_hits[i] - 1 - 100_000) / npixels_per_plane))
-
-        cur_val = (pixel_hits[i] - 1) % npixels_per_plane
-        last_time = cur_time    #Allows us to note any large time gaps for later analysis.
-        cur_time = pixel_times[i]
-
-        event.t_data.append(cur_time)
-
-        if(plane % 2 == 0):
-            event.x_data.append(cur_val)
-            event.y_data.append(np.nan)
-        else:
-            event.y_data.append(cur_val)
-            event.x_data.append(np.nan)
-
-        event.z_data.append(plane)
-        event.E_data.append(pixel_edep[i])
-
-        # #Keep track of any gaps in time between decays.
-        if cur_time - last_time > 1.0:      #TODO: Adjust this time gap (in ns) as needed.
-            event.gap_times.append(cur_time - last_time)
-
-        #Keep track of sum of energies deposited in each plane.
-        event.E_per_plane[plane] += pixel_edep[i]
-
-    #Keep track of particle IDs.
-    event.pixel_pdgs = tree.pixel_pdg
-
-    #Keep track of maximum energy deposited per plane in this event.
-    event.max_E = max(event.E_per_plane)
-
-    #Extract all (theta, phi) pairs from the calorimeter tree.
-    global_crys_dict = calo_analysis.get_crystal_data()
-    #Get the IDs of the crystals that were hit at those (theta, phi) pairs from the calorimeter tree.
-    event.crystal_ids = list(tree_calo.crystal)
-    event.calo_edep = list(tree_calo.edep)
-
-    # Use the IDs (tree_calo.crystal) to get the corresponding values from the dictionary of (ID: (r, theta, phi)) values (global_crys_dict).
-    event.r_theta_phis = []
-    for ID in event.crystal_ids:
-        event.r_theta_phis.append(global_crys_dict.get(ID))
+    #Extract x vs. t, y vs. t, and z vs. t data, along with the energy per plane and any gaps in time between decays, in one pass (compiled with
+    #Numba if it is installed; see _event_kernel.py).
+    plane, cur_val, is_x, event.E_per_plane, event.gap_times, event.max_E = _event_kernel.compute(hits, times, edep, npixels_per_plane,
+                                                                                                    len(event.E_per_plane))
+
+    event.t_data = times
+
+    #Even planes give us x-values while odd-numbered planes give us y-values. Rather than padding with NaNs, we keep the indices of the hits
+    #in each set of planes (from the kernel's is_x mask) so the x vs. z and y vs. z plots only receive real data points.
+    event.x_idx = np.flatnonzero(is_x)
+    event.y_idx = np.flatnonzero(~is_x)
+    event.x_vals = cur_val[event.x_idx]
+    event.x_z = plane[event.x_idx]
+    event.y_vals = cur_val[event.y_idx]
+    event.y_z = plane[event.y_idx]
+
+    event.z_data = plane
+    event.E_data = edep.astype(np.float32)
+
+    #Keep track of particle IDs. They are copied into a NumPy array so they can be split by x_idx / y_idx like the coordinates above.
+    event.pixel_pdgs = np.array(tree.pixel_pdg)
+
+    #The calorimeter plot is only drawn for events with more than 1 calo entry (see plot_event()), so we skip the calorimeter data for the rest.
+    if tree_calo.crystal.size() <= 1:
+        event.crystal_ids = np.empty(0, dtype = np.int32)
+        event.calo_edep = np.empty(0, dtype = np.float64)
+        event.thetas = np.empty(0)
+        event.phis = np.empty(0)
+        return event
+
+    #Get the IDs of the crystals that were hit at those (theta, phi) pairs from the calorimeter tree. Each std::vector is copied into a NumPy
+    #array in one step, with the dtype taken from the vector itself, since ROOT reuses the vectors for the next entry.
+    event.crystal_ids = np.array(tree_calo.crystal)
+    event.calo_edep = np.array(tree_calo.edep)
+
+    # Use the IDs (tree_calo.crystal) to get the rows of the corresponding (theta, phi) values from the cached crystal arrays. IDs that are not in
+    # the geometry get row -1, i.e., NaNs.
+    load_crystal_arrays()
+    rows = calo_analysis.get_crystal_rows(crys_ids, event.crystal_ids)
+    event.thetas = crys_thetas[rows]
+    event.phis = crys_phis[rows]
 
     # print("crystal IDs: ", event.crystal_ids)
     # print("edep: ", event.calo_edep)
-    # print("r_theta_phis: ", event.r_theta_phis)
+    # print("thetas: ", event.thetas)
+    # print("phis: ", event.phis)
 
     return event
 
@@ -88,13 +104,13 @@ def process_event(tree, tree_calo, event_index):
 def display_event(event):
     print("Length of pixel_pdgs: " + str(len(event.pixel_pdgs)))
     print("Length of t_data: " + str(len(event.t_data)))
-    print("Length of x_data: " + str(len(event.x_data)))
-    print("Length of y_data: " + str(len(event.y_data)))
+    print("Length of x_vals: " + str(len(event.x_vals)))
+    print("Length of y_vals: " + str(len(event.y_vals)))
     print("Length of z_data: " + str(len(event.z_data)))
     print("Length of E_data: " + str(len(event.E_data)))
     print("Length of E_per_plane: " + str(len(event.E_per_plane)))
     print("pixel_pdgs: " + str(event.pixel_pdgs))
-    print("x_data: " + str(event.x_data))
+    print("x_vals: " + str(event.x_vals))
     print("t_data: " + str(event.t_data))
 
 
@@ -105,49 +121,27 @@ def plot_with_color_legend(x_coords, y_coords, pixel_pdgs):
     labels = ["Pion", "Positron", "Electron", "Antimuon", "Muon"]
     particle_IDs = [211, -11, 11, -13, 13]
     
-    #Store list of tuples of our data to be processed below.
-    coords = zip(x_coords, y_coords, pixel_pdgs)
-
-    #Keep track of known particles and other particles to plot.
-    cur_data_to_plot = []
-    other_to_plot = []
-    other_IDs = []
     other_colors = ["k", "gray", "cyan", "indigo", "teal", "lime"]
 
-    #For each color, extract all pdgs of that color and display them on a scatter plot.
-    for i in range(0, len(particle_IDs)):
-        for coord in coords:
-            if coord[2] == particle_IDs[i]:                
-                cur_data_to_plot.append(coord)
-            elif coord[2] not in particle_IDs:  # Keep track of number of unidentified particles so we can plot them separately after exiting this loop.
-                other_to_plot.append(coord)
-
-                #Keep list of other IDs so we know how many labels are needed.
-                if coord[2] not in other_IDs:
-                    other_IDs.append(coord[2])
-                #str(pixel_pdg[i])
-        
-        #Plot data for corresponding color each loop, but only if the data for the corresponding color is not empty.
-        if len(cur_data_to_plot) != 0:
-            plt.scatter([coord[0] for coord in cur_data_to_plot], [coord[1] for coord in cur_data_to_plot], 10, colors[i], label = labels[i])
+    #Sort the data points into lists by particle ID in a single pass over the data.
+    coords_by_ID = {}
+    for x, y, pdg in zip(x_coords, y_coords, pixel_pdgs):
+        if pdg not in coords_by_ID:
+            coords_by_ID[pdg] = ([], [])
+        coords_by_ID[pdg][0].append(x)
+        coords_by_ID[pdg][1].append(y)
 
-        #Reset data to plot every loop.
-        cur_data_to_plot = []
+    #For each known particle ID, plot its data points, but only if there are any.
+    for i in range(0, len(particle_IDs)):
+        if particle_IDs[i] in coords_by_ID:
+            x, y = coords_by_ID[particle_IDs[i]]
+            plt.scatter(x, y, 10, colors[i], label = labels[i])
 
     #Plot the unidentified particles in distinct colors with their pdgs for labels.
+    other_IDs = [ID for ID in coords_by_ID if ID not in particle_IDs]
     for i in range(0, len(other_IDs)):
-        ID = other_IDs[i]
-        
-        #Extract x and y coordinates to plot only if they are all of the particle ID that we are currently plotting.
-        # [coord[0] for coord in other_to_plot if coord[2] == ID]
-        x = []
-        y = []
-        for coord in other_to_plot:
-            if coord[2] == ID:
-                x.append(coord[0])
-                y.append(coord[1])
-
-        plt.scatter(x, y, 10, other_colors[i], label = str(ID))
+        x, y = coords_by_ID[other_IDs[i]]
+        plt.scatter(x, y, 10, other_colors[i], label = str(other_IDs[i]))
 
 
 #Plot x vs. t, y vs. t, z vs. t, and E vs. z data from our event. The graphs will show the color-coding system used to represent different particles.
@@ -158,13 +152,13 @@ def plot_event(event, num_planes):
 
     plt.subplot(2,4,1)
 
-    print("x_data:", event.x_data)
-    print("y_data:", event.y_data)
+    print("x_vals:", event.x_vals)
+    print("y_vals:", event.y_vals)
     print("z_data:", event.z_data)
     print("t_data:", event.t_data)
     print("E_data:", event.E_data)
 
-    plot_with_color_legend(event.z_data, event.x_data, event.pixel_pdgs)
+    plot_with_color_legend(event.x_z, event.x_vals, event.pixel_pdgs[event.x_idx])
     plt.title("x vs. z")
     plt.xlabel("z (plane number)")
     plt.ylabel("x (pix)")
@@ -173,7 +167,7 @@ def plot_event(event, num_planes):
     plt.ylim(0, 100)
 
     plt.subplot(2,4,2)
-    plot_with_color_legend(event.z_data, event.y_data, event.pixel_pdgs)
+    plot_with_color_legend(event.y_z, event.y_vals, event.pixel_pdgs[event.y_idx])
     plt.title("y vs. z")
     plt.xlabel("z (plane number)")
     plt.ylabel("y (pix)")
@@ -206,8 +200,8 @@ def plot_event(event, num_planes):
     # color coded by energy deposition and surrounded by a black border to make faint colors easier to distinguish from the white background.
     if len(event.crystal_ids) > 1:
         color_range = event.calo_edep
-        thetas = [coords[1] for coords in event.r_theta_phis]
-        phis = [coords[2] for coords in event.r_theta_phis]
+        thetas = event.thetas
+        phis = event.phis
 
         plt.scatter(thetas, phis, c=color_range, cmap="YlOrRd", edgecolors="black")
         plt.xlabel("Theta (rad)")
@@ -233,24 +227,27 @@ def plot_event(event, num_planes):
 #is_event_DAR: Value of 0 = decays in flight, 1 = decays at rest, 2 = all data used.
 #num_events:  Controls how many events we want to select.
 def select_events(tree, is_event_DAR, num_events):
-    #Apply logical cut to select whether we want DARs and to exclude empty data. n stores the number of entries that satisfy this cut.
+    #Apply logical cut to select whether we want DARs and to exclude empty data.
     if is_event_DAR == 0:
-        cut = "!pion_dar && Sum$(pixel_edep) > 0"
+        cut = "!pion_dar && Sum(pixel_edep) > 0"
     elif is_event_DAR == 1:
-        cut = "pion_dar && Sum$(pixel_edep) > 0"
+        cut = "pion_dar && Sum(pixel_edep) > 0"
     else:
-        cut = "Sum$(pixel_edep) > 0"
-    n = tree.Draw("Entry$", cut, "goff")
-    
-    #Get all indices that satisfy the cut.
-    events = []
-    for i in range(n):
-        events.append(tree.GetV1()[i])
+        cut = "Sum(pixel_edep) > 0"
+
+    #rdfentry_ only equals the tree entry number (and comes out in order) when the event loop runs on a single thread, so we refuse to run
+    #with ROOT's implicit multi-threading enabled rather than return the wrong events.
+    if r.IsImplicitMTEnabled():
+        raise RuntimeError("select_events() requires ROOT's implicit multi-threading to be disabled (call ROOT.DisableImplicitMT() first).")
+
+    #Get the indices of all entries that satisfy the cut as a NumPy array in one pass over the tree.
+    df = r.RDataFrame(tree)
+    events = df.Filter(cut).Define("entry", "rdfentry_").AsNumpy(["entry"])["entry"]
 
-    selected_events = events[0:num_events]
+    selected_events = events[0:num_events].astype(np.int64).tolist()
     print("Indices of selected events: " + str(selected_events))
 
-    return [int(i) for i in selected_events]
+    return selected_events
 
 
 #Combines the functions we created above to give a visualization of events with the specified condition(s).
@@ -265,10 +262,10 @@ def event_visualization(tree, tree_calo, is_event_DAR, display_text_output, disp
     event_indices = select_events(tree, is_event_DAR, num_events)
 
     #Use max edep per plane as a heuristic to distinguish between DIFs and DARs.
-    max_Es = []
+    max_Es = np.empty(len(event_indices), dtype = np.float64)
 
-    #Keep track of gap times.
-    gap_times = []
+    #Keep track of gap times. Each event contributes an array of gap times, which are joined once at the end.
+    gap_times = [np.empty(0)]
 
     #For each of the event indices specified, process the corresponding event and display useful output if we want, then plot it.
     for i in range(len(event_indices)):
@@ -284,12 +281,11 @@ def event_visualization(tree, tree_calo, is_event_DAR, display_text_output, disp
             # print(e.max_E)
             plot_event(e, 50)
 
-        for gt in e.gap_times:
-            gap_times.append(gt)
+        gap_times.append(e.gap_times)
 
-        max_Es.append(e.max_E)
+        max_Es[i] = e.max_E
         
-    return (max_Es, gap_times)
+    return (max_Es, np.concatenate(gap_times))
 
 
 #Compare the maximum energy deposition of decays in flight and decays at rest. Show mean, median, and standard deviation for both sets of maximum energies, then plot them in
@@ -298,13 +294,15 @@ def event_visualization(tree, tree_calo, is_event_DAR, display_text_output, disp
 #max_Es_DAR:  Data for maximum energies from decays at rest.
 #num_bins:  Controls the number of bins used when plotting data on histograms.
 def compare_max_edep(max_Es_DIF, max_Es_DAR, num_bins):
-    max_Es_DIF_mean = np.mean(max_Es_DIF)
+    max_Es_DIF = np.ascontiguousarray(max_Es_DIF, dtype = np.float64)
+    max_Es_DIF_mean = max_Es_DIF.mean()
     max_Es_DIF_median = np.median(max_Es_DIF)
-    max_Es_DIF_std = np.std(max_Es_DIF)
+    max_Es_DIF_std = max_Es_DIF.std()
 
-    max_Es_DAR_mean = np.mean(max_Es_DAR)
+    max_Es_DAR = np.ascontiguousarray(max_Es_DAR, dtype = np.float64)
+    max_Es_DAR_mean = max_Es_DAR.mean()
     max_Es_DAR_median = np.median(max_Es_DAR)
-    max_Es_DAR_std = np.std(max_Es_DAR)
+    max_Es_DAR_std = max_Es_DAR.std()
 
     print("\nmax_Es_DIF_mean: " + str(max_Es_DIF_mean))
     print("max_Es_DIF_median: " + str(max_Es_DIF_median))
@@ -333,13 +331,15 @@ def compare_max_edep(max_Es_DIF, max_Es_DAR, num_bins):
 #gap_times_DAR:  Data for times between decays for DARs in ns.
 #num_bins:  Controls the number of bins used when plotting data on histograms.
 def compare_gap_times(gap_times_DIF, gap_times_DAR, num_bins):
-    gap_times_DIF_mean = np.mean(gap_times_DIF)
+    gap_times_DIF = np.ascontiguousarray(gap_times_DIF, dtype = np.float64)
+    gap_times_DIF_mean = gap_times_DIF.mean()
     gap_times_DIF_median = np.median(gap_times_DIF)
-    gap_times_DIF_std = np.std(gap_times_DIF)
+    gap_times_DIF_std = gap_times_DIF.std()
 
-    gap_times_DAR_mean = np.mean(gap_times_DAR)
+    gap_times_DAR = np.ascontiguousarray(gap_times_DAR, dtype = np.float64)
+    gap_times_DAR_mean = gap_times_DAR.mean()
     gap_times_DAR_median = np.median(gap_times_DAR)
-    gap_times_DAR_std = np.std(gap_times_DAR)
+    gap_times_DAR_std = gap_times_DAR.std()
 
     print("\ngap_times_DIF_mean: " + str(gap_times_DIF_mean))
     print("gap_times_DIF_median: " + str(gap_times_DIF_median))
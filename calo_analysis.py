@@ -71,4 +71,23 @@ def get_crystal_data():
     positions = get_crystal_data_from_gdml('./calo_plus_ATAR_PEN.gdml', key='position name="')
     positions_sph = {x:convert_to_spherical(positions[x]) for x in positions}
     
-    return positions_sph
\ No newline at end of file
+    return positions_sph
+
+#Get the same information as get_crystal_data(), but laid out as separate arrays of crystal IDs (sorted in increasing order) and of the r, theta,
+#and phi values for each of those crystals. The values for a crystal are found at the same row of each array.
+def get_crystal_arrays():
+    crys_dict = get_crystal_data()
+    ids = np.array(sorted(crys_dict))
+    r_theta_phis = np.array([crys_dict[ID] for ID in ids]).reshape(-1, 3)
+
+    return ids, r_theta_phis[:, 0].copy(), r_theta_phis[:, 1].copy(), r_theta_phis[:, 2].copy()
+
+
+#Find the row of each of the given crystal IDs in the sorted ID array returned by get_crystal_arrays(), using one binary search for all of them.
+#IDs that are not in the geometry get row -1.
+def get_crystal_rows(sorted_ids, crystal_ids):
+    crystal_ids = np.asarray(crystal_ids)
+    rows = np.minimum(np.searchsorted(sorted_ids, crystal_ids), len(sorted_ids) - 1)
+    rows[sorted_ids[rows] != crystal_ids] = -1
+
+    return rows
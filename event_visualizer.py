@@ -17,137 +17,252 @@ assumption that 100 strips comprise each plate in the simulation data supplied.
 from logging.config import IDENTIFIER
 from typing import overload
 import ROOT as r
+import uproot
 import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.colors import ListedColormap
+from matplotlib.lines import Line2D
 from matplotlib.ticker import StrMethodFormatter
 from Event import Event
 import calo_analysis
 
 
 class Event_Visualizer:
+    #Only the branches we actually use are read from each tree, which keeps uproot from decompressing the rest.
+    ATAR_BRANCHES = ["pixel_hits", "pixel_time", "pixel_edep", "pixel_pdg"]
+    CALO_BRANCHES = ["crystal", "edep"]
+
+    #Event indices that are at most this many entries apart are read together in one request. A larger gap starts a new request, so a sparse
+    #selection of events does not load every entry in between.
+    MAX_READ_GAP = 100
+
+    #Scatter plots with more points than this are rasterized rather than drawn marker by marker.
+    RASTERIZE_THRESHOLD = 500
+
+    #Store colors and corresponding particle type labels in one place for ease of editing. OTHER_COLORS are used for particles that are not in
+    #our list of known particle IDs.
+    PARTICLE_IDS = [211, -11, 11, -13, 13]
+    PARTICLE_COLORS = ["r", "b", "g", "y", "m"]
+    PARTICLE_LABELS = ["Pion", "Positron", "Electron", "Antimuon", "Muon"]
+    OTHER_COLORS = ["k", "gray", "cyan", "indigo", "teal", "lime"]
+
+    #The legend proxies for the known particles and the tick formatter for the time axis never change, so they are only built once.
+    _KNOWN_HANDLES = [Line2D([0], [0], marker = "o", color = "w", markerfacecolor = c, label = l) for c, l in zip(PARTICLE_COLORS, PARTICLE_LABELS)]
+    _FMT = StrMethodFormatter('{x:,.2f}')
+
+    def __init__(self):
+        self._input_file = None
+
+        #The theta and phi values of the crystals (the only coordinates we plot), cached by load_crystal_arrays() the first time an event is
+        #processed. They are not read here, since calo_analysis reads the geometry file relative to the current working directory.
+        self._crystal_ids = None
+        self._crys_thetas = None
+        self._crys_phis = None
+
+        #The figure from plot_event() is kept so that, when asked to, later events can be drawn by updating its scatter plots instead of
+        #rebuilding it.
+        self._fig = None
+        self._axes = {}
+        self._scatters = {}
+        self._cbar = None
+
+
     #TODO: Reimplement is_event_DAR along with select_events()
     '''
     The primary method that this class is used for. Uses helper functions below to give a visualization of events satisfying the specified condition(s).
-    input_file: The .root file that contains the data of interest. Should have been extracted as a TFile object before passing as a parameter.
-    event_index: The index of the event we want to investigate. Should be a positive integer.
+    input_file: The path to the .root file that contains the data of interest. The file is opened with uproot, so no TFile is needed.
+    event_indices: The index of the event we want to investigate, or a list / range / array of indices (e.g., range(start, stop) or the output of
+                   select_events()) to visualize several events. Indices should be positive integers.
     is_event_DAR (optional): Value of 0 = decays in flight, 1 = decays at rest, 2 = all data used. 2 is the default value if nothing is specified.
     display_text_output (optional): Value of True / False, controls whether we do / do not have our event data displayed in text format. Defaults
                                     to False (no text displayed).
+    reuse_figure (optional): Value of True / False. If True and the figure for the previous event in this call is still open (e.g., with plt.ion()
+                             or an interactive notebook backend), each event is drawn by updating that figure instead of creating a new one.
+                             Defaults to False (one figure per event).
     '''
-    def visualize_event(self, input_file, event_index, is_event_DAR = 2, display_text_output = False):
+    def visualize_event(self, input_file, event_indices, is_event_DAR = 2, display_text_output = False, reuse_figure = False):
 
         #Get the ATAR and calorimeter trees from our .root file.
-        tree_atar, tree_calo = self.get_trees(input_file)
+        self.get_trees(input_file)
+
+        #Only figures from this call are reused, so a new call never draws over the figure of an earlier one.
+        self._fig = None
+
+        #A (start, stop) tuple could mean either a range or two single events, so we ask for an explicit range or list instead.
+        if isinstance(event_indices, tuple) and len(event_indices) == 2:
+            raise TypeError("Pass range(start, stop) to visualize a range of events, or a list to visualize individual events.")
+
+        #A single index is treated as a list containing only that event.
+        event_indices = np.atleast_1d(np.asarray(event_indices, dtype = np.int64))
+
+        #select_events() returns an empty list when no event passes the cut, in which case there is nothing to read or plot.
+        if len(event_indices) == 0:
+            return (np.empty(0), np.empty(0))
+
+        #Group nearby indices into ranges that are each read with one request, so basket decompression is shared by the events in a range.
+        #Each range is read the first time one of its events is needed, and our events are then picked out of the arrays already in memory.
+        range_starts, range_stops = self.get_read_ranges(event_indices)
+        loaded_range = -1
 
         #Use max edep per plane as a heuristic to distinguish between DIFs and DARs.
-        max_Es = []
+        max_Es = np.empty(len(event_indices), dtype = np.float64)
 
-        #Keep track of gap times.
-        gap_times = []
+        #Keep track of gap times. Each event contributes an array of gap times, which are joined once at the end.
+        gap_times = [np.empty(0)]
 
-        #Process the event whose index we are given.
-        e = self.process_event(tree_atar, tree_calo, event_index)
+        #Process each event whose index we are given.
+        for i, event_index in enumerate(event_indices):
+            cur_range = np.searchsorted(range_starts, event_index, side = "right") - 1
+            if cur_range != loaded_range:
+                atar_arrays, calo_arrays = self.read_events(int(range_starts[cur_range]), int(range_stops[cur_range]))
+                loaded_range = cur_range
 
-        if display_text_output:
-            self.display_event(e)
+            e = self.process_event(atar_arrays, calo_arrays, event_index - range_starts[cur_range])
+
+            if display_text_output:
+                self.display_event(e)
+            
+            # TODO Need to incorporate 1) selection of events and 2) discrimination by max_E
         
-        # TODO Need to incorporate 1) selection of events and 2) discrimination by max_E
-    
-        self.plot_event(e, 50)
+            self.plot_event(e, 50, reuse_figure)
 
-        for gt in e.gap_times:
-            gap_times.append(gt)
+            gap_times.append(e.gap_times)
 
-        max_Es.append(e.max_E)
+            max_Es[i] = e.max_E
             
-        return (max_Es, gap_times)
+        return (max_Es, np.concatenate(gap_times))
 
     
-    #Uses the TFile retreived from the .root file to get the active target and calorimeter trees, which are used by other methods to get the
-    #data we need.
-    def get_trees(self, r_TFile):
-        self.tree_atar = r_TFile.Get("atar")
-        self.tree_calo = r_TFile.Get("calorimeter")
+    #Opens the .root file with uproot. The file handle is cached so that repeated calls with the same path do not reopen it.
+    def _open(self, input_file):
+        if self._input_file != input_file:
+            self._root_file = uproot.open(input_file)
+            self._input_file = input_file
+
+        return self._root_file
+
+
+    #Gets the active target and calorimeter trees from the .root file, which are used by other methods to get the data we need.
+    def get_trees(self, input_file):
+        root_file = self._open(input_file)
+        self.tree_atar = root_file["atar"]
+        self.tree_calo = root_file["calorimeter"]
 
         return self.tree_atar, self.tree_calo
 
 
+    #Splits the given event indices into the [start, stop) ranges of entries that visualize_event() reads with one request each. Indices that
+    #are at most MAX_READ_GAP entries apart share a range. Returns the starts and stops of the ranges as arrays, sorted by start.
+    def get_read_ranges(self, event_indices):
+        sorted_indices = np.unique(event_indices)
+        breaks = np.flatnonzero(np.diff(sorted_indices) > self.MAX_READ_GAP) + 1
+        range_starts = sorted_indices[np.concatenate(([0], breaks))]
+        range_stops = sorted_indices[np.concatenate((breaks - 1, [len(sorted_indices) - 1]))] + 1
+
+        return range_starts, range_stops
+
+
+    #The crystal geometry is the same for every event, so we only read it once instead of once per event in process_event(). The theta and phi
+    #values are stored in separate arrays, each with one extra NaN at the end. Crystal IDs that are not in the geometry (e.g., the single volume
+    #ID 1000) are mapped to that last row.
+    def load_crystal_arrays(self):
+        if self._crystal_ids is None:
+            crystal_ids, _, thetas, phis = calo_analysis.get_crystal_arrays()
+            self._crys_thetas = np.append(thetas, np.nan)
+            self._crys_phis = np.append(phis, np.nan)
+            self._crystal_ids = crystal_ids
+
+
+    #Reads the events in [start, stop) from both trees with a single bulk request per tree. Each branch comes back as an array holding one
+    #NumPy array per event. get_trees() must have been called first.
+    def read_events(self, start, stop):
+        atar_arrays = self.tree_atar.arrays(self.ATAR_BRANCHES, entry_start = start, entry_stop = stop, library = "np")
+        calo_arrays = self.tree_calo.arrays(self.CALO_BRANCHES, entry_start = start, entry_stop = stop, library = "np")
+
+        return atar_arrays, calo_arrays
+
+
     '''
     Returns the time vs. x and time vs. y data from the pixel_hits. The ATAR is made up of sheets that contain alternating horizontal or vertical strips with npixels_per_plane.
     If npixels_per_plane were 100, for instance, 100036 would represent plate 1, 36 / 100 in x, 100161 would represent plate 2, 61 / 100 in y, etc. The output for each of 
     x and y is an n x 2 matrix, where the first column contains the times corresponding to the coordinate values in the second column.
     Also extract the z (plane #) vs. time data. The third element of the tuples contained in this list and the x and y lists will contain corresponding colors to represent
     when particles have decayed.
+    atar_arrays / calo_arrays: The arrays returned by read_events().
+    local_index: The position of the event within those arrays (i.e., its index relative to the start of the range that was read).
     '''
-    def process_event(self, tree_atar, tree_calo, event_index):
-        #Get the specified entries from our trees so we can extract data from them.
-        tree_atar.GetEntry(event_index)
-        tree_calo.GetEntry(event_index)
-
+    def process_event(self, atar_arrays, calo_arrays, local_index):
         #Store pixel hits for the entry printed above in which a pion didn't decay at rest.
-        pixel_times = tree_atar.pixel_time
-        pixel_hits = tree_atar.pixel_hits
-        pixel_edep = tree_atar.pixel_edep
+        pixel_times = atar_arrays["pixel_time"][local_index]
+        pixel_hits = atar_arrays["pixel_hits"][local_index].astype(np.int32)
+        pixel_edep = atar_arrays["pixel_edep"][local_index]
         
-        #Initialize lists for storing color (for labeling data points according to decay product), t, x, y, z, energy, and energy per plane using the Event class.
+        #Initialize arrays for storing t, x, y, z, energy, and energy per plane using the Event class.
         npixels_per_plane = 100
         event = Event()
 
-        #Init time value so 1st loop below works.
-        cur_time = 0
-        
-        #Extract x vs. t, y vs. t, and z vs. t data. Also add indexed color coding to represent different particles.
-        for i in range(pixel_hits.size()):
-            #We can get the plane number using some modular arithmetic on the pixel_hits values. Since these numbers start at 100,000, we must subtract
-            #100,000. We also have to subtract 1 to deal with 100 wrapping around to 0 when it shouldn't (i.e., an "off by one" error).
-            plane = int(np.floor((pixel_hits[i] - 1 - 100_000) / npixels_per_plane))
-
-            cur_val = (pixel_hits[i] - 1) % npixels_per_plane
-            last_time = cur_time    #Allows us to note any large time gaps for later analysis.
-            cur_time = pixel_times[i]
-
-            event.t_data.append(cur_time)
-
-            #Even planes give us x-values while odd-numbered planes give us y-values. We can use some simple modular arithmetic to distinguish between
-            #the two. We must also add NaNs to fill in the gaps in x_data and y_data to make sure the indices of actual data points correspond to the
-            #timestamps recorded in t_data.
-            if(plane % 2 == 0):
-                event.x_data.append(cur_val)
-                event.y_data.append(np.nan)
-            else:
-                event.y_data.append(cur_val)
-                event.x_data.append(np.nan)
-
-            event.z_data.append(plane)
-            event.E_data.append(pixel_edep[i])
-
-            #Keep track of any gaps in time between decays.
-            if cur_time - last_time > 1.0:      #TODO: Adjust this time gap (in ns) as needed.
-                event.gap_times.append(cur_time - last_time)
-
-            #Keep track of sum of energies deposited in each plane.
-            event.E_per_plane[plane] += pixel_edep[i]
+        #We can get the plane number using some integer arithmetic on the pixel_hits values. Since these numbers start at 100,000, we must subtract
+        #100,000. We also have to subtract 1 to deal with 100 wrapping around to 0 when it shouldn't (i.e., an "off by one" error).
+        #Plane numbers (0 to 49) and strip values (0 to 99) both fit in a uint8, which keeps the arrays passed to matplotlib small.
+        plane = (pixel_hits - 100_001) // npixels_per_plane
+
+        #Out-of-range hits would silently wrap around in the uint8 cast (e.g., plane -1 becomes 255), so we fail here as _event_kernel.py does.
+        if len(plane) > 0 and (plane.min() < 0 or plane.max() >= len(event.E_per_plane)):
+            raise IndexError("pixel hit lies outside of the ATAR planes")
+
+        plane = plane.astype(np.uint8)
+        cur_val = ((pixel_hits - 1) % npixels_per_plane).astype(np.uint8)
+
+        event.t_data = pixel_times
+
+        #Even planes give us x-values while odd-numbered planes give us y-values. Rather than padding with NaNs, we keep the indices of the hits
+        #in each set of planes so the x vs. z and y vs. z plots only receive real data points.
+        #The parity of the plane number is its lowest bit, so one bitwise AND gives a mask we can use for both sets of planes.
+        is_y = (plane & 1).astype(bool)
+        event.x_idx = np.flatnonzero(~is_y)
+        event.y_idx = np.flatnonzero(is_y)
+        event.x_vals = cur_val[event.x_idx]
+        event.x_z = plane[event.x_idx]
+        event.y_vals = cur_val[event.y_idx]
+        event.y_z = plane[event.y_idx]
+
+        event.z_data = plane
+
+        #Single precision is plenty for plotting the energy of each hit. The sums per plane below still use the full float64 values.
+        event.E_data = pixel_edep.astype(np.float32)
+
+        #Keep track of any gaps in time between decays. The first hit is measured from t = 0, so a late first hit also counts as a gap.
+        gaps = np.diff(pixel_times, prepend = 0.0)
+        event.gap_times = gaps[gaps > 1.0]      #TODO: Adjust this time gap (in ns) as needed.
+
+        #Keep track of sum of energies deposited in each plane, filling the float64 array preallocated by the Event class.
+        event.E_per_plane[:] = np.bincount(plane, weights = pixel_edep, minlength = len(event.E_per_plane))
 
         #Keep track of particle IDs.
-        event.pixel_pdgs = tree_atar.pixel_pdg
+        event.pixel_pdgs = atar_arrays["pixel_pdg"][local_index]
 
         #Keep track of maximum energy deposited per plane in this event.
-        event.max_E = max(event.E_per_plane)
+        event.max_E = event.E_per_plane.max()
 
-        #Extract all (theta, phi) pairs from the calorimeter tree.
-        global_crys_dict = calo_analysis.get_crystal_data()
         #Get the IDs of the crystals that were hit at those (theta, phi) pairs from the calorimeter tree.
-        event.crystal_ids = list(tree_calo.crystal)
-        event.calo_edep = list(tree_calo.edep)
+        event.crystal_ids = calo_arrays["crystal"][local_index]
+        event.calo_edep = calo_arrays["edep"][local_index]
 
-        # Use the IDs (tree_calo.crystal) to get the corresponding values from the dictionary of (ID: (r, theta, phi)) values (global_crys_dict).
-        event.r_theta_phis = []
-        for ID in event.crystal_ids:
-            event.r_theta_phis.append(global_crys_dict.get(ID))
+        #The calorimeter panel is only drawn for events with more than 1 calo entry (see plot_calo()), so we skip the lookup for the rest.
+        if len(event.crystal_ids) <= 1:
+            event.thetas = np.empty(0)
+            event.phis = np.empty(0)
+        else:
+            # Use the IDs (calo_arrays["crystal"]) to get the rows of the corresponding (theta, phi) values from our cached crystal arrays.
+            self.load_crystal_arrays()
+            rows = calo_analysis.get_crystal_rows(self._crystal_ids, event.crystal_ids)
+            event.thetas = self._crys_thetas[rows]
+            event.phis = self._crys_phis[rows]
 
         # print("crystal IDs: ", event.crystal_ids)
         # print("edep: ", event.calo_edep)
-        # print("r_theta_phis: ", event.r_theta_phis)
+        # print("thetas: ", event.thetas)
+        # print("phis: ", event.phis)
 
         return event
 
@@ -155,16 +270,16 @@ class Event_Visualizer:
     #Show some useful data describing our event in textual form.
     def display_event(self, event):
         print("Length of pixel_pdgs: ", len(event.pixel_pdgs))
-        print("Length of x_data: ", len(event.x_data))
-        print("Length of y_data: ", len(event.y_data))
+        print("Length of x_vals: ", len(event.x_vals))
+        print("Length of y_vals: ", len(event.y_vals))
         print("Length of z_data: ", len(event.z_data))
         print("Length of t_data: ", len(event.t_data))
         print("Length of E_data: ", len(event.E_data))
         print("Length of E_per_plane: ", len(event.E_per_plane), "\n\n")
 
         print("pixel_pdgs: ", str(event.pixel_pdgs), "\n")
-        print("x_data:", event.x_data, "\n")
-        print("y_data:", event.y_data, "\n")
+        print("x_vals:", event.x_vals, "\n")
+        print("y_vals:", event.y_vals, "\n")
         print("z_data:", event.z_data, "\n")
         print("t_data:", event.t_data, "\n")
         print("E_data:", event.E_data)
@@ -172,64 +287,72 @@ class Event_Visualizer:
 
     #Plot the following data from our event: x vs. t, y vs. t, z vs. t, E vs. z, and energy deposited in calorimeter by (theta, phi). The graphs 
     #will show the color-coding system used to represent different particles. Display 0 to num_planes on plots including the z variable.
-    def plot_event(self, event, num_planes):
-
-        fig = plt.figure(figsize = (15, 10))
-
-        plt.subplot(2,4,1)
-        self.plot_with_color_legend(event.z_data, event.x_data, event.pixel_pdgs)
+    #If reuse_figure is True and the figure from the previous call is still open, that figure is reused and only the data in its scatter plots
+    #is replaced. Otherwise a new figure is created.
+    def plot_event(self, event, num_planes, reuse_figure = False):
+        #Color-code the whole event once so each particle type gets the same color in every panel.
+        color_idx, cmap, handles = self.get_color_coding(event.pixel_pdgs)
+
+        #The (x, y, color index) data for each of the color-coded panels.
+        panels = {
+            "x": (event.x_z, event.x_vals, color_idx[event.x_idx]),
+            "y": (event.y_z, event.y_vals, color_idx[event.y_idx]),
+            "z": (event.t_data, event.z_data, color_idx),
+        }
+
+        if reuse_figure and self._fig is not None and plt.fignum_exists(self._fig.number):
+            self.update_event_plot(event, panels, cmap, handles)
+
+            #Let the GUI event loop run so the updated figure is actually displayed before the next event replaces it.
+            self._fig.canvas.draw_idle()
+            plt.pause(0.001)
+            return
+
+        self._fig = plt.figure(figsize = (15, 10))
+        self._axes = {}
+        self._scatters = {}
+        self._cbar = None
+
+        self._axes["x"] = plt.subplot(2,4,1)
+        self._scatters["x"] = self.plot_with_color_legend(*panels["x"], cmap)
         plt.title("x vs. z")
         plt.xlabel("z (plane number)")
         plt.ylabel("x (pixels)")
-        plt.legend()
+        plt.legend(handles = handles, loc = "upper right", frameon = False)
         plt.xlim(0, num_planes)
         plt.ylim(0, 100)
 
-        plt.subplot(2,4,2)
-        self.plot_with_color_legend(event.z_data, event.y_data, event.pixel_pdgs)
+        self._axes["y"] = plt.subplot(2,4,2)
+        self._scatters["y"] = self.plot_with_color_legend(*panels["y"], cmap)
         plt.title("y vs. z")
         plt.xlabel("z (plane number)")
         plt.ylabel("y (pixels)")
         plt.xlim(0, num_planes)
         plt.ylim(0, 100)
 
-        plt.subplot(2,4,3)
-        self.plot_with_color_legend(event.t_data, event.z_data, event.pixel_pdgs)
+        self._axes["z"] = plt.subplot(2,4,3)
+        self._scatters["z"] = self.plot_with_color_legend(*panels["z"], cmap)
         plt.title("z vs. t")
         plt.xlabel("t (ns)")
         plt.ylabel("z (plane number)")
-        plt.gca().xaxis.set_major_formatter(StrMethodFormatter('{x:,.2f}'))     #Ensures only 2 decimal places are shown on x-axis, decreasing clutter.
+        plt.gca().xaxis.set_major_formatter(self._FMT)      #Ensures only 2 decimal places are shown on x-axis, decreasing clutter.
         # plt.xlim(0, 60)
         plt.ylim(0, num_planes)
 
-        plt.subplot(2,4,4)
-        plt.scatter(event.z_data, event.E_data, 10, label = "e_dep")
-        plt.scatter(range(50), event.E_per_plane, 10, "black", label = "e_dep per plane")
+        self._axes["E"] = plt.subplot(2,4,4)
+        self._scatters["E"] = plt.scatter(event.z_data, event.E_data, 10, label = "e_dep",
+                                          rasterized = len(event.E_data) > self.RASTERIZE_THRESHOLD)
+        self._scatters["E_per_plane"] = plt.scatter(np.arange(len(event.E_per_plane)), event.E_per_plane, 10, "black",
+                                                    label = "e_dep per plane")
         plt.title("ATAR Energy Deposition Per Plane vs. z")
         plt.xlabel("z (plane number)")
         plt.ylabel("Energy (MeV / plane)")
-        plt.legend()
+        plt.legend(loc = "upper right", frameon = False)
         #plt.xlim(0, num_planes)
 
         #Here, we plot the calo analysis data.
-        plt.subplot(2,4,5)
-
-        # Plot scatterplot of energy deposited in each SIPM "pixel" in the calorimeter. Also check to see if only 1 calo entry
-        # is present - in this case, the calo ID could be marked as a single volume and we just get 1000, which we don't want to count. The points are
-        # color coded by energy deposition and surrounded by a black border to make faint colors easier to distinguish from the white background.
-        if len(event.crystal_ids) > 1:
-            color_range = event.calo_edep
-            thetas = [coords[1] for coords in event.r_theta_phis]
-            phis = [coords[2] for coords in event.r_theta_phis]
-
-            plt.scatter(thetas, phis, c=color_range, cmap="YlOrRd", edgecolors="black")
-            plt.xlabel("Theta (rad)")
-            plt.ylabel("Phi (rad)")
-            plt.title("Energy Deposited in Calorimeter SiPMs \n by Theta vs. Phi")
-            plt.xlim(0, 3.2)
-            plt.ylim(-3.2, 3.2)
-            cbar = plt.colorbar()
-            cbar.set_label('Amount of Energy Deposited (MeV)')
+        self._axes["calo"] = plt.subplot(2,4,5)
+        self.plot_calo(event)
 
         # plt.subplots_adjust(left = 0.1,
         #                     bottom = 0.1,
@@ -242,79 +365,128 @@ class Event_Visualizer:
         plt.show()
 
 
-    #For each color in a list of color labels for different particles, plot the corresponding data.
-    def plot_with_color_legend(self, x_coords, y_coords, pixel_pdgs):
-        #Store colors and corresponding particle type labels in one place for ease of editing.
-        colors = ["r", "b", "g", "y", "m"]
-        labels = ["Pion", "Positron", "Electron", "Antimuon", "Muon"]
-        particle_IDs = [211, -11, 11, -13, 13]
-        
-        #Store list of tuples of our data to be processed below.
-        coords = list(zip(x_coords, y_coords, pixel_pdgs))
-
-        #Keep track of known particles and other particles to plot.
-        cur_data_to_plot = []
-        other_to_plot = []
-        other_IDs = []
-        other_colors = ["k", "gray", "cyan", "indigo", "teal", "lime"]
-
-        #For each color, extract all pdgs of that color and display them on a scatter plot.
-        for i in range(0, len(particle_IDs)):
-            for coord in coords:
-                if coord[2] == particle_IDs[i]:
-                    cur_data_to_plot.append(coord)
-                elif coord[2] not in particle_IDs:
-                    #Keep track of unidentified particles and their IDs so we can plot them separately after exiting this loop.
-                    other_to_plot.append(coord)
-                    if coord[2] not in other_IDs:
-                        other_IDs.append(coord[2])
-            
-            #Plot data for corresponding color each loop, but only if the data for the corresponding color is not empty.
-            if len(cur_data_to_plot) != 0:
-                plt.scatter([coord[0] for coord in cur_data_to_plot], [coord[1] for coord in cur_data_to_plot], 10, colors[i], label = labels[i])
-
-            #Reset data to plot every loop.
-            cur_data_to_plot = []
+    #Replace the data shown in the figure from plot_event() with the data from a new event. The axes, labels and formatters are kept, and the
+    #panels without fixed limits are rescaled to the new data.
+    def update_event_plot(self, event, panels, cmap, handles):
+        for key, (x_coords, y_coords, color_idx) in panels.items():
+            scatter = self._scatters[key]
+            scatter.set_offsets(np.column_stack([x_coords, y_coords]))
+            scatter.set_array(color_idx)
+            scatter.set_cmap(cmap)
+            scatter.set_clim(0, len(cmap.colors) - 1)
+            scatter.set_rasterized(len(x_coords) > self.RASTERIZE_THRESHOLD)
+        self._axes["x"].legend(handles = handles, loc = "upper right", frameon = False)
+
+        self._scatters["E"].set_offsets(np.column_stack([event.z_data, event.E_data]))
+        self._scatters["E"].set_rasterized(len(event.E_data) > self.RASTERIZE_THRESHOLD)
+        self._scatters["E_per_plane"].set_offsets(np.column_stack([np.arange(len(event.E_per_plane)), event.E_per_plane]))
+
+        #Scatter plots do not rescale their axes when their data is replaced, so we reset the data limits ourselves.
+        for key, scatters in (("z", ["z"]), ("E", ["E", "E_per_plane"])):
+            ax = self._axes[key]
+            ax.ignore_existing_data_limits = True
+            for scatter_key in scatters:
+                ax.update_datalim(self._scatters[scatter_key].get_offsets())
+            ax.autoscale_view()
+
+        plt.sca(self._axes["calo"])
+        self.plot_calo(event)
+
+
+    # Plot scatterplot of energy deposited in each SIPM "pixel" in the calorimeter. Also check to see if only 1 calo entry
+    # is present - in this case, the calo ID could be marked as a single volume and we just get 1000, which we don't want to count. The points are
+    # color coded by energy deposition and surrounded by a black border to make faint colors easier to distinguish from the white background.
+    # Draws on the current axes the first time there is calorimeter data to show, and updates that scatter plot for later events.
+    def plot_calo(self, event):
+        has_calo_data = len(event.crystal_ids) > 1
+        thetas = event.thetas
+        phis = event.phis
+
+        if "calo" not in self._scatters:
+            if not has_calo_data:
+                return
 
-        #Plot the unidentified particles in distinct colors with their pdgs for labels.
-        for i in range(0, len(other_IDs)):
-            ID = other_IDs[i]
-            
-            #Extract x and y coordinates to plot only if they are all of the particle ID that we are currently plotting.
-            # [coord[0] for coord in other_to_plot if coord[2] == ID]
-            x = []
-            y = []
-            for coord in other_to_plot:
-                if coord[2] == ID:
-                    x.append(coord[0])
-                    y.append(coord[1])
+            color_range = event.calo_edep
 
-            plt.scatter(x, y, 10, other_colors[i], label = str(ID))
+            self._scatters["calo"] = plt.scatter(thetas, phis, c=color_range, cmap="YlOrRd", edgecolors="black",
+                                                 rasterized = len(thetas) > self.RASTERIZE_THRESHOLD)
+            plt.xlabel("Theta (rad)")
+            plt.ylabel("Phi (rad)")
+            plt.title("Energy Deposited in Calorimeter SiPMs \n by Theta vs. Phi")
+            plt.xlim(0, 3.2)
+            plt.ylim(-3.2, 3.2)
+            self._cbar = plt.colorbar()
+            self._cbar.set_label('Amount of Energy Deposited (MeV)')
+            return
+
+        scatter = self._scatters["calo"]
+        if has_calo_data:
+            scatter.set_offsets(np.column_stack([thetas, phis]))
+            scatter.set_array(np.asarray(event.calo_edep))
+            scatter.autoscale()
+            scatter.set_rasterized(len(thetas) > self.RASTERIZE_THRESHOLD)
+        scatter.set_visible(has_calo_data)
+        self._cbar.ax.set_visible(has_calo_data)
+
+
+    #Assign every hit the index of the color used for its particle type. Known particles use the index of their ID in PARTICLE_IDS, and each
+    #unidentified particle type gets the next free index so it is drawn in one of OTHER_COLORS. Returns the color indices, the colormap they
+    #index into, and proxy legend handles (one per particle type present) for the caller to pass to plt.legend().
+    def get_color_coding(self, pixel_pdgs):
+        pixel_pdgs = np.asarray(pixel_pdgs)
+        color_idx = np.empty(len(pixel_pdgs), dtype = np.int8)
+        handles = []
+        for i, pid in enumerate(self.PARTICLE_IDS):
+            mask = pixel_pdgs == pid
+            color_idx[mask] = i
+            if mask.any():
+                handles.append(self._KNOWN_HANDLES[i])
+
+        unknown_mask = ~np.isin(pixel_pdgs, self.PARTICLE_IDS)
+        other_IDs = np.unique(pixel_pdgs[unknown_mask])
+        for j, pid in enumerate(other_IDs):
+            color_idx[pixel_pdgs == pid] = len(self.PARTICLE_IDS) + j
+            handles.append(Line2D([0], [0], marker = "o", color = "w", markerfacecolor = self.OTHER_COLORS[j], label = str(pid)))
+
+        cmap = ListedColormap(self.PARTICLE_COLORS + self.OTHER_COLORS[:len(other_IDs)])
+
+        return color_idx, cmap, handles
+
+
+    #Plot the data with each point colored by its particle type. All points are drawn by a single scatter call using the color indices and
+    #colormap from get_color_coding(). Returns the scatter plot so its data can be replaced later.
+    def plot_with_color_legend(self, x_coords, y_coords, color_idx, cmap):
+        return plt.scatter(x_coords, y_coords, s = 10, c = color_idx, cmap = cmap, vmin = 0, vmax = len(cmap.colors) - 1,
+                           rasterized = len(x_coords) > self.RASTERIZE_THRESHOLD)
 
 
     # TODO This method needs to be adapted after first round of changes have been made.
     #Use cuts to select the events we want from the tree. Returns an integer list of the indices of the events that we want from the tree.
+    #input_file: The path to the .root file. Its ATAR tree is read with an RDataFrame.
     #is_event_DAR: Value of 0 = decays in flight, 1 = decays at rest, 2 = all data used.
     #num_events:  Controls how many events we want to select.
-    def select_events(self, tree, is_event_DAR, num_events):
-        #Apply logical cut to select whether we want DARs and to exclude empty data. n stores the number of entries that satisfy this cut.
+    def select_events(self, input_file, is_event_DAR, num_events):
+        #Apply logical cut to select whether we want DARs and to exclude empty data.
         if is_event_DAR == 0:
-            cut = "!pion_dar && Sum$(pixel_edep) > 0"
+            cut = "!pion_dar && Sum(pixel_edep) > 0"
         elif is_event_DAR == 1:
-            cut = "pion_dar && Sum$(pixel_edep) > 0"
+            cut = "pion_dar && Sum(pixel_edep) > 0"
         else:
-            cut = "Sum$(pixel_edep) > 0"
-        n = tree.Draw("Entry$", cut, "goff")
-        
-        #Get all indices that satisfy the cut.
-        events = []
-        for i in range(n):
-            events.append(tree.GetV1()[i])
+            cut = "Sum(pixel_edep) > 0"
+
+        #rdfentry_ only equals the tree entry number (and comes out in order) when the event loop runs on a single thread, so we refuse to run
+        #with ROOT's implicit multi-threading enabled rather than return the wrong events.
+        if r.IsImplicitMTEnabled():
+            raise RuntimeError("select_events() requires ROOT's implicit multi-threading to be disabled (call ROOT.DisableImplicitMT() first).")
+
+        #Get the indices of all entries that satisfy the cut as a NumPy array in one pass over the tree.
+        df = r.RDataFrame("atar", input_file)
+        events = df.Filter(cut).Define("entry", "rdfentry_").AsNumpy(["entry"])["entry"]
 
-        selected_events = events[0:num_events]
+        selected_events = events[0:num_events].astype(np.int64).tolist()
         print("Indices of selected events: " + str(selected_events))
 
-        return [int(i) for i in selected_events]
+        return selected_events
 
 
     '''
@@ -325,13 +497,15 @@ class Event_Visualizer:
     num_bins:  Controls the number of bins used when plotting data on histograms.
     '''
     def compare_max_edep(self, max_Es_DIF, max_Es_DAR, num_bins):
-        max_Es_DIF_mean = np.mean(max_Es_DIF)
+        max_Es_DIF = np.ascontiguousarray(max_Es_DIF, dtype = np.float64)
+        max_Es_DIF_mean = max_Es_DIF.mean()
         max_Es_DIF_median = np.median(max_Es_DIF)
-        max_Es_DIF_std = np.std(max_Es_DIF)
+        max_Es_DIF_std = max_Es_DIF.std()
 
-        max_Es_DAR_mean = np.mean(max_Es_DAR)
+        max_Es_DAR = np.ascontiguousarray(max_Es_DAR, dtype = np.float64)
+        max_Es_DAR_mean = max_Es_DAR.mean()
         max_Es_DAR_median = np.median(max_Es_DAR)
-        max_Es_DAR_std = np.std(max_Es_DAR)
+        max_Es_DAR_std = max_Es_DAR.std()
 
         print("\nmax_Es_DIF_mean: " + str(max_Es_DIF_mean))
         print("max_Es_DIF_median: " + str(max_Es_DIF_median))
@@ -362,13 +536,15 @@ class Event_Visualizer:
     num_bins:  Controls the number of bins used when plotting data on histograms.
     '''
     def compare_gap_times(self, gap_times_DIF, gap_times_DAR, num_bins):
-        gap_times_DIF_mean = np.mean(gap_times_DIF)
+        gap_times_DIF = np.ascontiguousarray(gap_times_DIF, dtype = np.float64)
+        gap_times_DIF_mean = gap_times_DIF.mean()
         gap_times_DIF_median = np.median(gap_times_DIF)
-        gap_times_DIF_std = np.std(gap_times_DIF)
+        gap_times_DIF_std = gap_times_DIF.std()
 
-        gap_times_DAR_mean = np.mean(gap_times_DAR)
+        gap_times_DAR = np.ascontiguousarray(gap_times_DAR, dtype = np.float64)
+        gap_times_DAR_mean = gap_times_DAR.mean()
         gap_times_DAR_median = np.median(gap_times_DAR)
-        gap_times_DAR_std = np.std(gap_times_DAR)
+        gap_times_DAR_std = gap_times_DAR.std()
 
         print("\ngap_times_DIF_mean: " + str(gap_times_DIF_mean))
         print("gap_times_DIF_median: " + str(gap_times_DIF_median))